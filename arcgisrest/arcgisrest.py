@@ -10,18 +10,36 @@
    Copyright 2020 Esri Canada - All Rights Reserved
    Released under the MIT license. See LICENSE file for details"""
 
+import asyncio
 import logging
-from typing import Union
+import sys
+import threading
+from types import MappingProxyType
+from typing import Mapping, Union
 from urllib.parse import urlsplit
 
+import requests
 import urllib3
+from urllib3.util.retry import Retry
 
 from .connection import Connection
+from .resolver import CachedResolver, CachedResolverAdapter
+from .utils import httpx
 
-# Disable warning and debug messages from libraries
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-logging.getLogger("requests").setLevel(logging.WARNING)
-logging.getLogger("urllib3").setLevel(logging.WARNING)
+# The asynchronous requests are only available when aiohttp is installed
+try:
+	import aiohttp
+except ImportError:
+	aiohttp = None
+
+
+# Transient server errors (e.g. while a federated server restarts) are retried with an increasing delay, only for idempotent methods
+# Read timeouts are not retried, as the server is then already slow to process the request, and are raised unchanged
+_RETRY = Retry(total=3, read=False, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}), raise_on_status=False)
+
+
+# Required to get JSON from GeoEvent endpoints (ignored by others), sent with every request of the shared sessions
+_ACCEPT = 'application/json'
 
 
 class ArcgisRest():
@@ -34,9 +52,17 @@ class ArcgisRest():
 	_use_https: bool = True
 	_verify_ssl: bool = True
 	_public_host: str = None
-	_web_adaptors: str = None
+	_web_adaptors: dict = None
+	_web_adaptors_view: Mapping = None
 	_timeout: Union[float, tuple] = None
 	_swapToken: bool = False
+	_warnings_configured: bool = False
+	_session: requests.Session = None
+	_resolver: CachedResolver = None
+	_token_store: dict = None
+	_async_session = None
+	_async_loop: asyncio.AbstractEventLoop = None
+	_async_token_lock: asyncio.Lock = None
 
 	_WEB_ADAPTORS_TEMPLATE: dict = {
 		'portal': None,
@@ -52,7 +78,7 @@ class ArcgisRest():
 
 
 	# Intialization
-	def __init__(self, server: str, username: str = None, password: str = None, web_adaptors: dict = None, public_host: str = None, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05, swapToken: bool = False):
+	def __init__(self, server: str, username: str = None, password: str = None, web_adaptors: dict = None, public_host: str = None, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05, swapToken: bool = False, dns_ttl: float = 300, transport: str = 'requests'):
 		"""Handle connections and requests to various ArcGIS Enterprise endpoints.
 
 		Args:
@@ -62,20 +88,31 @@ class ArcgisRest():
 			web_adaptors (dict, optional): The web adaptor/proxy directory names in a dictionnary {'portal': str, 'arcgis': str}. If not specified, uses a direct connection with the default port and endpoint.
 			public_host (str, optional): The public host used by the servers (e.g. `example.com`). This is normally the host/domain via which the main Web Adaptors (or reverse proxies) are accesible and the same as the value used for the *WebContextURL* properties. Used for direct connections. Default to None.
 			verify_ssl (bool, optional): Whether to verify the SSL certificates and prevent credentials from being sent over un-encrypted connections. Defaults to True.
-			timeout (float or tuple, optional): How many seconds to wait for the server to send data before giving up, as a float, or a (connect timeout, read timeout) tuple. To wait forever, pass a None value. Defaults to 3.05 seconds.
+			timeout (float or tuple, optional): How many seconds to wait for the server to send data before giving up, as a float, or a (connect timeout, read timeout) tuple. A float is used as the connect timeout, with ten times that value as the read timeout. To wait forever, pass a None value. Defaults to 3.05 seconds.
 			swapToken (bool, optional): Whether portal tokens will be swapped for ArcGIS Server tokens before use
 				on federated servers. Defaults to false as normally the portal token can be used.
+			dns_ttl (float, optional): How many seconds the server's DNS resolution is re-used before being looked up again. Defaults to 300 seconds.
+			transport (str, optional): The HTTP library used to send requests, either 'requests' or 'httpx' (HTTP/2, requires the httpx[http2] package). Defaults to 'requests'.
+
+		Raises:
+			ValueError: Incorrect value passed for transport.
+			ImportError: The httpx transport was chosen but httpx isn't installed.
 		"""
 
+		self._configureWarnings()
+
 		# Store properties
 		us = urlsplit(server)
-		self._use_https = us.scheme == 'HTTPS'
+		self._use_https = us.scheme.lower() == 'https'
 		self._server = us.netloc
 
 		self._username = username
 		self._password = password
 		self._verify_ssl = verify_ssl
 		self._public_host = public_host
+		# A single value is the connect timeout, allowing longer reads so large responses aren't cut off
+		if isinstance(timeout, (int, float)):
+			timeout = (timeout, timeout * 10)
 		self._timeout = timeout
 		self._swapToken = swapToken
 
@@ -84,6 +121,28 @@ class ArcgisRest():
 			self._web_adaptors['portal'] = web_adaptors.get('portal')
 			self._web_adaptors['arcgis'] = web_adaptors.get('arcgis')
 			self._web_adaptors['geoevent'] = None
+		self._web_adaptors_view = MappingProxyType(self._web_adaptors)
+
+		# Tokens are stored per instance so that they are never shared between different credentials
+		self._token_store = {}
+
+		# Initialize the shared session, re-using connections across token and REST requests
+		if transport == 'requests':
+			self._resolver = CachedResolver(dns_ttl)
+			self._session = requests.Session()
+			adapter = CachedResolverAdapter(self._resolver, pool_connections=10, pool_maxsize=20, max_retries=_RETRY)
+			self._session.mount('http://', adapter)
+			self._session.mount('https://', adapter)
+			self._session.headers['Accept'] = _ACCEPT
+
+		elif transport == 'httpx':
+			if httpx is None:
+				raise ImportError('The httpx transport requires the httpx[http2] package.')
+			# Follow redirects (e.g. http to https web adaptors, or item data downloads) as the requests transport does
+			self._session = httpx.Client(http2=True, verify=verify_ssl, follow_redirects=True, limits=httpx.Limits(max_keepalive_connections=16), headers={'Accept': _ACCEPT})
+
+		else:
+			raise ValueError('Transport must be one of ["requests", "httpx"].')
 
 		# Initialize the connection handlers
 		self._portal = Connection(self, 'portal')
@@ -93,6 +152,103 @@ class ArcgisRest():
 		#END
 
 
+	# Session Management
+	def close(self, wait: bool = True):
+		"""Close the shared session and the pooled connections of all connection handlers.
+
+		Args:
+			wait (bool, optional): Whether to wait for the connections to be closed, rather than closing them in the background. Defaults to True.
+		"""
+
+		# Connections can't be closed in the background once the interpreter is shutting down
+		if wait or sys.is_finalizing():
+			self._session.close()
+		else:
+			threading.Thread(target=self._session.close, name='arcgisrest-close', daemon=True).start()
+
+		return
+
+
+	async def aclose(self):
+		"""Close the shared session, as well as the asynchronous session if one was created."""
+		self.close()
+
+		if self._async_session is not None and not self._async_session.closed:
+			await self._async_session.close()
+
+		return
+
+
+	def __enter__(self):
+		"""Use the instance within a with block, closing the shared session when leaving it."""
+		return self
+
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		"""Close the shared session in the background, so that leaving the block doesn't wait on each pooled connection."""
+		self.close(wait=False)
+
+		#END
+
+
+	async def __aenter__(self):
+		"""Use the instance within an async with block, closing both shared sessions when leaving it."""
+		return self
+
+
+	async def __aexit__(self, exc_type, exc_val, exc_tb):
+		"""Close both shared sessions."""
+		await self.aclose()
+
+		#END
+
+
+	def _createAsyncSession(self):
+		"""Create the asynchronous session and token lock for the running event loop.
+
+		Raises:
+			ImportError: The aiohttp package is not installed.
+			RuntimeError: The session created for another event loop is still open.
+		"""
+		if aiohttp is None:
+			raise ImportError('Asynchronous requests require the aiohttp package.')
+
+		# An open session's connections belong to the loop that created it, so they can't be closed (nor re-used) from this one
+		if self._async_session is not None and not self._async_session.closed:
+			raise RuntimeError('The asynchronous session is still open in another event loop. Close it with aclose() (or use the ArcgisRest instance in an async with block) before sending requests from a new event loop.')
+
+		if self._timeout is None:
+			timeout = aiohttp.ClientTimeout(total=None)
+		else:
+			timeout = aiohttp.ClientTimeout(sock_connect=self._timeout[0], sock_read=self._timeout[1])
+
+		# The connector bounds how many requests are in flight to the server at once, the others wait for a free connection
+		connector = aiohttp.TCPConnector(limit_per_host=64, ssl=None if self._verify_ssl else False)
+
+		self._async_session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers={'Accept': _ACCEPT})
+		self._async_token_lock = asyncio.Lock()
+		self._async_loop = asyncio.get_running_loop()
+
+		return
+
+
+	@classmethod
+	def _configureWarnings(cls):
+		"""Disable warning and debug messages from libraries, once per process and only when a client is created. Log levels already set by the caller are kept."""
+		if cls._warnings_configured:
+			return
+
+		urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+		for name in ["requests", "urllib3"]:
+			logger = logging.getLogger(name)
+			if logger.level == logging.NOTSET:
+				logger.setLevel(logging.WARNING)
+
+		ArcgisRest._warnings_configured = True
+
+		return
+
+
 	# Property Accessors
 	@property
 	def server(self) -> str:
@@ -112,6 +268,7 @@ class ArcgisRest():
 		return self._password
 
 
+	@property
 	def use_https(self) -> bool:
 		"""bool: Whether to use a secure HTTPS connection."""
 		return self._use_https
@@ -130,14 +287,14 @@ class ArcgisRest():
 
 
 	@property
-	def web_adaptors(self) -> dict:
-		"""WedAdaptors dict: The name of the web adaptors used on this server."""
-		return self._web_adaptors.copy()
+	def web_adaptors(self) -> Mapping:
+		"""Mapping: The name of the web adaptors used on this server, as a read-only view (use dict() for a mutable copy)."""
+		return self._web_adaptors_view
 
 
 	@property
 	def timeout(self) -> Union[float, tuple]:
-		"""How many seconds to wait for the server to send data before giving up. If a tuple then (connect timeout, read timeout), if None then wait forever."""
+		"""tuple: How many seconds to wait for the server to send data before giving up as a (connect timeout, read timeout) tuple, if None then wait forever."""
 		return self._timeout
 	
 
@@ -147,6 +304,36 @@ class ArcgisRest():
 		return self._swapToken
 
 
+	@property
+	def session(self) -> requests.Session:
+		"""requests.Session: The session shared by all connection handlers, pooling connections to the server (an httpx.Client with the httpx transport)."""
+		return self._session
+
+
+	@property
+	def async_session(self):
+		"""aiohttp.ClientSession: The session shared by the asynchronous requests of all connection handlers, created on first use within the running event loop (requires aiohttp). It must be closed with aclose() before sending requests from another event loop."""
+		if self._async_session is None or self._async_session.closed or self._async_loop is not asyncio.get_running_loop():
+			self._createAsyncSession()
+
+		return self._async_session
+
+
+	@property
+	def async_token_lock(self) -> asyncio.Lock:
+		"""asyncio.Lock: Guards the acquisition of tokens by asynchronous requests, so that concurrent requests share a single token request."""
+		if self._async_token_lock is None or self._async_loop is not asyncio.get_running_loop():
+			self._createAsyncSession()
+
+		return self._async_token_lock
+
+
+	@property
+	def token_store(self) -> dict:
+		"""dict: The tokens obtained with this instance's credentials, stored for re-use until they are about to expire."""
+		return self._token_store
+
+
 	@property
 	def portal(self) -> Connection:
 		"""Connection: The ArcGIS Portal connection handler."""
@@ -9,10 +9,14 @@
    Copyright 2020 Esri Canada - All Rights Reserved
    Released under the MIT license. See LICENSE file for details"""
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Iterator, Tuple, Union
+
 import requests
 
-from .tokens import getToken
-from .utils import readEsriJson
+from .tokens import _getStoredToken, getToken, invalidateToken
+from .utils import ArcGISError, ParsedUrl, parseUrl, readEsriJson, readEsriJsonAsync, readEsriJsonStreaming, sendRequest
 
 #region CONSTANTS —————————————————————————————————————————————————————————————————————————————————
 
@@ -40,6 +44,20 @@ ENDPOINT_PROPERTIES = {
 	}
 }
 
+# Request methods accepted, sending a body, and sent without a token nor format
+_VALID_METHODS = frozenset({'GET', 'OPTIONS', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE'})
+_BODY_METHODS = frozenset({'POST', 'PUT', 'PATCH'})
+_NO_BODY_METHODS = frozenset({'HEAD', 'OPTIONS'})
+
+# Placeholder for requests using the timeout of the ArcgisRest instance (as None waits forever)
+_DEFAULT_TIMEOUT = object()
+
+# Number of full URLs kept by each connection
+_URL_CACHE_SIZE = 256
+
+# ArcGIS error codes reported for an invalid or expired token
+_INVALID_TOKEN_CODES = (498, 499)
+
 #endregion
 
 
@@ -50,6 +68,13 @@ class Connection():
 
 	_arcgisrest = None
 	_endpoint_type: str = None
+	_ep: dict = None
+	_parsed_url: ParsedUrl = None
+	_url_prefix_rest: str = None
+	_url_prefix_admin: str = None
+	_mixin_no_token: dict = None
+	_mixin_with_token: tuple = (None, None)
+	_url_cache: dict = None
 
 
 	def __init__(self, arcgisrest, endpoint_type: str):
@@ -66,10 +91,25 @@ class Connection():
 		# Store the values as properties
 		self._arcgisrest = arcgisrest
 
-		if endpoint_type not in ['portal', 'arcgis', 'geoevent']:
+		try:
+			self._ep = ENDPOINT_PROPERTIES[endpoint_type]
+		except KeyError:
 			raise ValueError('Endpoint type must be one of ["portal", "arcgis", "geoevent"].')
 		self._endpoint_type = endpoint_type
 
+		# The server and directories are fixed for the life of the connection, so derive the URL prefixes once rather than on every request
+		web_adaptor = arcgisrest.web_adaptors[endpoint_type]
+		self._url_prefix_rest = self._derivePrefix(web_adaptor)
+		self._url_prefix_admin = self._derivePrefix(web_adaptor, True)
+		self._url_cache = {}
+
+		# Base and referer URLs used for this endpoint's tokens
+		self._parsed_url = parseUrl(self._url_prefix_rest)
+
+		# ArcGIS ∴ mixin f=json (and the token once known) to every request
+		if endpoint_type in ['portal', 'arcgis']:
+			self._mixin_no_token = {'f': 'json'}
+
 		#END
 
 
@@ -89,8 +129,8 @@ class Connection():
 
 	#region REQUESTS ——————————————————————————————————————————————————————————————————————————————
 
-	def _request(self, method: str, path: str, params: dict = None, data: dict = None, json: dict = None, files: dict = None, admin: bool = False) -> requests.Response:
-		"""Send a request of any method type, adjusting the body and headers to handle tokens and format. Will also check for errors reported by the ArcGIS Server.
+	def _send(self, method: str, path: str, params: dict = None, data: dict = None, json: dict = None, files: dict = None, admin: bool = False, stream: bool = False, timeout: Union[float, tuple] = _DEFAULT_TIMEOUT) -> tuple:
+		"""Send a request of any method type, adjusting the body and headers to handle tokens and format, without reading its response.
 
 		Args:
 			method (str): method for the new Request object: GET, OPTIONS, HEAD, POST, PUT, PATCH, or DELETE.
@@ -100,62 +140,91 @@ class Connection():
 			json (dict, optional): json data to send in the body of the Request (POST, PUT, PATCH). Defaults to None.
 			files (dict, optional): [description]. Dictionary of files to send (see requests library for details). Defaults to None.
 			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+			stream (bool, optional): Whether to leave the body unread, for it to be parsed as it is received. Defaults to False.
+			timeout (float or tuple, optional): How many seconds to wait for the server to send data before giving up, as a float, or a (connect timeout, read timeout) tuple, overriding the ArcgisRest instance's timeout (e.g. for long running admin operations). A float is used as the connect timeout, with ten times that value as the read timeout. To wait forever, pass a None value. Defaults to the instance's timeout.
 
 		Raises:
-			ValueError: If incorrect method passed.
+			ValueError: If incorrect method passed, or a streamed response is requested through the httpx transport.
 			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
-			requests.exceptions.HTTPError: An non-successful value is received from the server (either from the web server, or from within the ArcGIS response).
 
 		Returns:
-			requests.Response: The response from the requests module.
+			tuple: The (requests.Response, token data dictionary used by the request or None).
 		"""
 
-		# Check method is valid
-		if method not in ['GET', 'OPTIONS', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE']:
-			raise ValueError('The request method must be GET, OPTIONS, HEAD, POST, PUT, PATCH, or DELETE.')
+		url = self._prepareUrl(method, path, admin)
 
-		# GeoEvent using web apators not support
-		if self.endpoint_type == 'geoevent' and self.arcgisrest.web_adaptors['arcgis'] is not None:
-			raise NotImplementedError('Sending a GeoEvent request via a proxied (or web adaptor) endpoint is not supported. Please use a direct connection.')
+		# Streamed responses are parsed from the raw body of the requests transport
+		if stream and not isinstance(self.arcgisrest.session, requests.Session):
+			raise ValueError('Streamed responses are only supported by the requests transport.')
 
-		# Derive the full URL
-		web_adaptor = self.arcgisrest.web_adaptors[self.endpoint_type]
-		url = self._deriveUrl(path, web_adaptor, admin)
+		# A single value is the connect timeout, as for the instance's timeout
+		if timeout is _DEFAULT_TIMEOUT:
+			timeout = self.arcgisrest.timeout
+		elif isinstance(timeout, (int, float)):
+			timeout = (timeout, timeout * 10)
 
 		# Append token and format to the request
 		headers = {}
+		token_data = None
 
-		if method not in ['HEAD', 'OPTIONS']:
+		if method not in _NO_BODY_METHODS:
 			# Obtain a token
-			token_data = None
 			if self.arcgisrest.username and self.arcgisrest.password:
-				token_data = getToken(self.endpoint_type, url, self.arcgisrest.username, self.arcgisrest.password, self.arcgisrest.public_host, self.arcgisrest.verify_ssl, self.arcgisrest.timeout, self.arcgisrest.swapToken)
+				token_data = self._getTokenData()
 
-			# Generate the requires params and headers
-			if method == 'GET' and params is None:
-				params = {}
-			elif method in ['POST', 'PUT', 'PATCH'] and data is None and json is None:
-				data = {}
+			params, data, json, headers = self._prepareBodies(method, params, data, json, token_data)
 
-			params, data, json = self._mixinBodies([params, data, json], token_data['token'])
-			headers = self._getHeaders(token_data)
+		# Send the request
+		response = sendRequest(self.arcgisrest.session, method, url, self.arcgisrest.verify_ssl, timeout, params=params, data=data, json=json, files=files, headers=headers, stream=stream)
 
-		# Send the request (and parse for errors)
-		req = self._session or requests
+		return response, token_data
 
-		response = req.request(method, url, params=params, data=data, json=json, files=files, headers=headers, timeout=self.arcgisrest.timeout, verify=self.arcgisrest.verify_ssl)
 
-		readEsriJson(response, 'executing a {} request'.format(method.lower()))
+	def _request(self, method: str, path: str, params: dict = None, data: dict = None, json: dict = None, files: dict = None, admin: bool = False, stream: bool = False, timeout: Union[float, tuple] = _DEFAULT_TIMEOUT) -> requests.Response:
+		"""Send a request of any method type, adjusting the body and headers to handle tokens and format. Will also check for errors reported by the ArcGIS Server.
+
+		Args:
+			method (str): method for the new Request object: GET, OPTIONS, HEAD, POST, PUT, PATCH, or DELETE.
+			path (str): Path to which to send the request, after the endpoints rest directory.
+			params (dict, optional): Dictionary to send in the query string for the Request (for GET). Defaults to None.
+			data (dict, optional): Dictionary, to send in the body of the Request (POST, PUT, PATCH). Defaults to None.
+			json (dict, optional): json data to send in the body of the Request (POST, PUT, PATCH). Defaults to None.
+			files (dict, optional): [description]. Dictionary of files to send (see requests library for details). Defaults to None.
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+			stream (bool, optional): Whether to leave the body unread, for it to be parsed as it is received by readEsriJsonStreaming (which then checks for errors). Defaults to False.
+			timeout (float or tuple, optional): Overrides the ArcgisRest instance's timeout for this request, as described in _send. Defaults to the instance's timeout.
+
+		Raises:
+			ValueError: If incorrect method passed, or a streamed response is requested through the httpx transport.
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+			requests.exceptions.HTTPError: An non-successful value is received from the server (either from the web server, or from within the ArcGIS response).
+
+		Returns:
+			requests.Response: The response from the requests module.
+		"""
+
+		response, token_data = self._send(method, path, params, data, json, files, admin, stream, timeout)
+
+		# Streamed bodies are only read (and checked) as the caller iterates over them
+		if stream:
+			return response
+
+		try:
+			readEsriJson(response, f'executing a {method.lower()} request')
+		except ArcGISError as e:
+			self._discardRejectedToken(e, token_data)
+			raise
 
 		return response
 
 
-	def head(self, path: str, admin: bool = False) -> requests.Response:
+	def head(self, path: str, admin: bool = False, timeout: Union[float, tuple] = _DEFAULT_TIMEOUT) -> requests.Response:
 		"""Sends a HEAD request, automatically handling the URL derivation and the authentication.
 
 		Args:
 			path (str): Path to which to send the request, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
 			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+			timeout (float or tuple, optional): Overrides the ArcgisRest instance's timeout for this request (e.g. for long running admin operations), with the same format. Defaults to the instance's timeout.
 
 		Raises:
 			ValueError: If incorrect method passed.
@@ -165,18 +234,18 @@ class Connection():
 		Returns:
 			requests.Response: The response from the requests module.
 		"""
-		response = self._request('HEAD', path, admin=admin)
-
-		return response
+		return self._request('HEAD', path, admin=admin, timeout=timeout)
 
 
-	def get(self, path: str, params: dict = None, admin: bool = False) -> requests.Response:
+	def get(self, path: str, params: dict = None, admin: bool = False, stream: bool = False, timeout: Union[float, tuple] = _DEFAULT_TIMEOUT) -> requests.Response:
 		"""Sends a GET request, automatically handling the URL derivation and the authentication.
 
 		Args:
 			path (str): Path to which to send the request, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
 			params (dict): URL parameters of the request. Defaults to None.
 			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+			stream (bool, optional): Whether to leave the body unread, for it to be parsed with readEsriJsonStreaming instead of being checked for ArcGIS errors. Defaults to False.
+			timeout (float or tuple, optional): Overrides the ArcgisRest instance's timeout for this request (e.g. for long running admin operations), with the same format. Defaults to the instance's timeout.
 
 		Raises:
 			ValueError: If incorrect method passed.
@@ -186,12 +255,10 @@ class Connection():
 		Returns:
 			requests.Response: The response from the requests module, after having been checked for ArcGIS errors.
 		"""
-		response = self._request('GET', path, params=params, admin=admin)
-
-		return response
+		return self._request('GET', path, params=params, admin=admin, stream=stream, timeout=timeout)
 
 
-	def post(self, path: str, data: dict = None, json: dict = None, files: dict = None, admin: bool = False) -> requests.Response:
+	def post(self, path: str, data: dict = None, json: dict = None, files: dict = None, admin: bool = False, stream: bool = False, timeout: Union[float, tuple] = _DEFAULT_TIMEOUT) -> requests.Response:
 		"""Sends a POST request, automatically handling the URL derivation and the authentication.
 
 		Args:
@@ -200,6 +267,8 @@ class Connection():
 			json (dict): Body of the request to be sent as JSON. Defaults to None.
 			files (dict, optional): [description]. Dictionary of files to send (see requests library for details). Defaults to None.
 			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+			stream (bool, optional): Whether to leave the body unread, for it to be parsed with readEsriJsonStreaming instead of being checked for ArcGIS errors. Defaults to False.
+			timeout (float or tuple, optional): Overrides the ArcgisRest instance's timeout for this request (e.g. for long running admin operations), with the same format. Defaults to the instance's timeout.
 
 		Raises:
 			ValueError: If incorrect method passed.
@@ -209,12 +278,10 @@ class Connection():
 		Returns:
 			requests.Response: The response from the requests module, after having been checked for ArcGIS errors.
 		"""
-		response = self._request('POST', path, data=data, json=json, files=files, admin=admin)
-
-		return response
+		return self._request('POST', path, data=data, json=json, files=files, admin=admin, stream=stream, timeout=timeout)
 
 
-	def put(self, path: str, data: dict = None, json: dict = None, files: dict = None, admin: bool = False) -> requests.Response:
+	def put(self, path: str, data: dict = None, json: dict = None, files: dict = None, admin: bool = False, timeout: Union[float, tuple] = _DEFAULT_TIMEOUT) -> requests.Response:
 		"""Sends a PUT request, automatically handling the URL derivation and the authentication.
 
 		Args:
@@ -223,6 +290,7 @@ class Connection():
 			json (dict): Body of the request to be sent as JSON. Defaults to None.
 			files (dict, optional): [description]. Dictionary of files to send (see requests library for details). Defaults to None.
 			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+			timeout (float or tuple, optional): Overrides the ArcgisRest instance's timeout for this request (e.g. for long running admin operations), with the same format. Defaults to the instance's timeout.
 
 		Raises:
 			ValueError: If incorrect method passed.
@@ -232,12 +300,10 @@ class Connection():
 		Returns:
 			requests.Response: The response from the requests module, after having been checked for ArcGIS errors.
 		"""
-		response = self._request('PUT', path, data=data, json=json, files=files, admin=admin)
-
-		return response
+		return self._request('PUT', path, data=data, json=json, files=files, admin=admin, timeout=timeout)
 
 
-	def patch(self, path: str, data: dict = None, json: dict = None, files: dict = None, admin: bool = False) -> requests.Response:
+	def patch(self, path: str, data: dict = None, json: dict = None, files: dict = None, admin: bool = False, timeout: Union[float, tuple] = _DEFAULT_TIMEOUT) -> requests.Response:
 		"""Sends a PATCH request, automatically handling the URL derivation and the authentication.
 
 		Args:
@@ -246,6 +312,7 @@ class Connection():
 			json (dict): Body of the request to be sent as JSON. Defaults to None.
 			files (dict, optional): [description]. Dictionary of files to send (see requests library for details). Defaults to None.
 			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+			timeout (float or tuple, optional): Overrides the ArcgisRest instance's timeout for this request (e.g. for long running admin operations), with the same format. Defaults to the instance's timeout.
 
 		Raises:
 			ValueError: If incorrect method passed.
@@ -255,17 +322,16 @@ class Connection():
 		Returns:
 			requests.Response: The response from the requests module, after having been checked for ArcGIS errors.
 		"""
-		response = self._request('PATCH', path, data=data, json=json, files=files, admin=admin)
-
-		return response
+		return self._request('PATCH', path, data=data, json=json, files=files, admin=admin, timeout=timeout)
 
 
-	def delete(self, path: str, admin: bool = False) -> requests.Response:
+	def delete(self, path: str, admin: bool = False, timeout: Union[float, tuple] = _DEFAULT_TIMEOUT) -> requests.Response:
 		"""Sends a DELETE request, automatically handling the URL derivation and the authentication.
 
 		Args:
 			path (str): Path to which to send the request, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
 			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+			timeout (float or tuple, optional): Overrides the ArcgisRest instance's timeout for this request (e.g. for long running admin operations), with the same format. Defaults to the instance's timeout.
 
 		Raises:
 			ValueError: If incorrect method passed.
@@ -275,50 +341,414 @@ class Connection():
 		Returns:
 			requests.Response: The response from the requests module, after having been checked for ArcGIS errors.
 		"""
-		response = self._request('DELETE', path, admin=admin)
+		return self._request('DELETE', path, admin=admin, timeout=timeout)
 
-		return response
+
+	def requestMany(self, method: str, paths: Iterable[str], params: dict = None, data: dict = None, json: dict = None, admin: bool = False, max_workers: int = 8, timeout: Union[float, tuple] = _DEFAULT_TIMEOUT) -> Iterator[Tuple[str, requests.Response]]:
+		"""Sends the same request to several paths concurrently from a pool of threads, automatically handling the URL derivation and the authentication.
+
+		Args:
+			method (str): method of the requests: GET, OPTIONS, HEAD, POST, PUT, PATCH, or DELETE.
+			paths (Iterable[str]): Paths to which to send the requests, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
+			params (dict, optional): URL parameters of each request. Defaults to None.
+			data (dict, optional): Body of each request. Defaults to None.
+			json (dict, optional): Body of each request to be sent as JSON. Defaults to None.
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+			max_workers (int, optional): How many requests are sent at once. Defaults to 8.
+			timeout (float or tuple, optional): Overrides the ArcgisRest instance's timeout for this request (e.g. for long running admin operations), with the same format. Defaults to the instance's timeout.
+
+		Raises:
+			ValueError: If incorrect method passed.
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+			requests.exceptions.HTTPError: An non-successful value is received from the server (either from the web server, or from within the ArcGIS response).
+
+		Yields:
+			tuple: The (path, requests.Response) of each request, in the order in which they complete.
+		"""
+
+		# Obtain the token once up front, rather than having every thread wait on its acquisition
+		if method not in _NO_BODY_METHODS and self.arcgisrest.username and self.arcgisrest.password:
+			self._getTokenData()
+
+		executor = ThreadPoolExecutor(max_workers=max_workers)
+		futures = {executor.submit(self._request, method, path, params, data, json, None, admin, False, timeout): path for path in paths}
+
+		try:
+			for future in as_completed(futures):
+				yield futures[future], future.result()
+
+		finally:
+			# Don't send the remaining requests if the caller stops iterating (or a request failed)
+			for future in futures:
+				future.cancel()
+			executor.shutdown()
+
+		return
+
+
+	def streamItems(self, method: str, path: str, params: dict = None, data: dict = None, json: dict = None, admin: bool = False, prefix: str = 'features.item', timeout: Union[float, tuple] = _DEFAULT_TIMEOUT) -> Iterator:
+		"""Sends a request whose large JSON response (e.g. the features of a query) is parsed as it is received, yielding its items one by one. Requires the ijson package and the requests transport.
+
+		Args:
+			method (str): method of the request: GET or POST.
+			path (str): Path to which to send the request, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
+			params (dict, optional): URL parameters of the request. Defaults to None.
+			data (dict, optional): Body of the request. Defaults to None.
+			json (dict, optional): Body of the request to be sent as JSON. Defaults to None.
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+			prefix (str, optional): The ijson prefix of the items to yield. Defaults to 'features.item'.
+			timeout (float or tuple, optional): Overrides the ArcgisRest instance's timeout for this request (e.g. for long running admin operations), with the same format. Defaults to the instance's timeout.
+
+		Raises:
+			ValueError: If incorrect method passed, or the httpx transport is used.
+			ImportError: The ijson package is not installed.
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+			requests.exceptions.HTTPError: An non-successful value is received from the server (either from the web server, or from within the ArcGIS response).
+
+		Yields:
+			dict: Each item found under the prefix, as it is received.
+		"""
+
+		response, token_data = self._send(method, path, params, data, json, None, admin, True, timeout)
+
+		try:
+			yield from readEsriJsonStreaming(response, f'executing a streamed {method.lower()} request', prefix)
+
+		except ArcGISError as e:
+			self._discardRejectedToken(e, token_data)
+			raise
+
+		finally:
+			# Release the connection even if the caller stops iterating early
+			response.close()
+
+		return
 
 	#endregion
 
 
-	#region SESSION MANAGERS ——————————————————————————————————————————————————————————————————————
+	#region ASYNCHRONOUS REQUESTS —————————————————————————————————————————————————————————————————
 
-	_session: requests.Session = None
+	async def _arequest(self, method: str, path: str, params: dict = None, data: dict = None, json: dict = None, admin: bool = False) -> dict:
+		"""Asynchronously send a request of any method type, adjusting the body and headers to handle tokens and format. Will also check for errors reported by the ArcGIS Server. Requires aiohttp.
 
-	def __enter__(self):
-		"""Start a request session, enabling connection-pooling. Improves performance when making several consecutive requests to the same host."""
-		self._session = requests.Session()
+		Args:
+			method (str): method of the request: GET, OPTIONS, HEAD, POST, PUT, PATCH, or DELETE.
+			path (str): Path to which to send the request, after the endpoints rest directory.
+			params (dict, optional): Dictionary to send in the query string of the request (for GET). Defaults to None.
+			data (dict, optional): Dictionary, to send in the body of the request (POST, PUT, PATCH). Defaults to None.
+			json (dict, optional): json data to send in the body of the request (POST, PUT, PATCH). Defaults to None.
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+
+		Raises:
+			ValueError: If incorrect method passed.
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+			ImportError: The aiohttp package is not installed.
+			requests.exceptions.HTTPError: An non-successful value is received from the server (either from the web server, or from within the ArcGIS response).
+
+		Returns:
+			dict: The JSON dictionary from the response, or None if the response has no body.
+		"""
+
+		url = self._prepareUrl(method, path, admin)
+		session = self.arcgisrest.async_session
+
+		# Append token and format to the request
+		headers = {}
+		token_data = None
+
+		if method not in _NO_BODY_METHODS:
+			# Obtain a token, re-using the stored one straight away when available
+			if self.arcgisrest.username and self.arcgisrest.password:
+				token_data = _getStoredToken(self._parsed_url.base, self.arcgisrest.token_store)
+
+				# Otherwise acquire it in a thread as it blocks on requests, with the lock making concurrent requests wait for the first one's token
+				if token_data is None:
+					async with self.arcgisrest.async_token_lock:
+						token_data = _getStoredToken(self._parsed_url.base, self.arcgisrest.token_store)
+						if token_data is None:
+							token_data = await asyncio.get_running_loop().run_in_executor(None, self._getTokenData)
 
+			params, data, json, headers = self._prepareBodies(method, params, data, json, token_data)
+
+		# Send the request (and parse for errors)
+		async with session.request(method, url, params=self._stringifyValues(params), data=self._stringifyValues(data), json=json, headers=headers) as response:
+			try:
+				return await readEsriJsonAsync(response, f'executing a {method.lower()} request')
+			except ArcGISError as e:
+				self._discardRejectedToken(e, token_data)
+				raise
+
+
+	async def ahead(self, path: str, admin: bool = False) -> dict:
+		"""Asynchronously sends a HEAD request, automatically handling the URL derivation and the authentication.
+
+		Args:
+			path (str): Path to which to send the request, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+
+		Raises:
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+			requests.exceptions.HTTPError: An non-successful value is received from the server.
+
+		Returns:
+			dict: Always None as HEAD responses have no body.
+		"""
+		return await self._arequest('HEAD', path, admin=admin)
+
+
+	async def aget(self, path: str, params: dict = None, admin: bool = False) -> dict:
+		"""Asynchronously sends a GET request, automatically handling the URL derivation and the authentication.
+
+		Args:
+			path (str): Path to which to send the request, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
+			params (dict): URL parameters of the request. Defaults to None.
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+
+		Raises:
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+			requests.exceptions.HTTPError: An non-successful value is received from the server (either from the web server, or from within the ArcGIS response).
+
+		Returns:
+			dict: The JSON dictionary from the response, after having been checked for ArcGIS errors.
+		"""
+		return await self._arequest('GET', path, params=params, admin=admin)
+
+
+	async def apost(self, path: str, data: dict = None, json: dict = None, admin: bool = False) -> dict:
+		"""Asynchronously sends a POST request, automatically handling the URL derivation and the authentication.
+
+		Args:
+			path (str): Path to which to send the request, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
+			data (dict): Body of the request. Defaults to None.
+			json (dict): Body of the request to be sent as JSON. Defaults to None.
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+
+		Raises:
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+			requests.exceptions.HTTPError: An non-successful value is received from the server (either from the web server, or from within the ArcGIS response).
+
+		Returns:
+			dict: The JSON dictionary from the response, after having been checked for ArcGIS errors.
+		"""
+		return await self._arequest('POST', path, data=data, json=json, admin=admin)
+
+
+	async def aput(self, path: str, data: dict = None, json: dict = None, admin: bool = False) -> dict:
+		"""Asynchronously sends a PUT request, automatically handling the URL derivation and the authentication.
+
+		Args:
+			path (str): Path to which to send the request, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
+			data (dict): Body of the request. Defaults to None.
+			json (dict): Body of the request to be sent as JSON. Defaults to None.
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+
+		Raises:
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+			requests.exceptions.HTTPError: An non-successful value is received from the server (either from the web server, or from within the ArcGIS response).
+
+		Returns:
+			dict: The JSON dictionary from the response, after having been checked for ArcGIS errors.
+		"""
+		return await self._arequest('PUT', path, data=data, json=json, admin=admin)
+
+
+	async def apatch(self, path: str, data: dict = None, json: dict = None, admin: bool = False) -> dict:
+		"""Asynchronously sends a PATCH request, automatically handling the URL derivation and the authentication.
+
+		Args:
+			path (str): Path to which to send the request, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
+			data (dict): Body of the request. Defaults to None.
+			json (dict): Body of the request to be sent as JSON. Defaults to None.
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+
+		Raises:
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+			requests.exceptions.HTTPError: An non-successful value is received from the server (either from the web server, or from within the ArcGIS response).
+
+		Returns:
+			dict: The JSON dictionary from the response, after having been checked for ArcGIS errors.
+		"""
+		return await self._arequest('PATCH', path, data=data, json=json, admin=admin)
+
+
+	async def adelete(self, path: str, admin: bool = False) -> dict:
+		"""Asynchronously sends a DELETE request, automatically handling the URL derivation and the authentication.
+
+		Args:
+			path (str): Path to which to send the request, after the endpoints rest directory (e.g. what comes after https://example.com/arcgis/rest).
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+
+		Raises:
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+			requests.exceptions.HTTPError: An non-successful value is received from the server (either from the web server, or from within the ArcGIS response).
+
+		Returns:
+			dict: The JSON dictionary from the response, after having been checked for ArcGIS errors.
+		"""
+		return await self._arequest('DELETE', path, admin=admin)
+
+	#endregion
+
+
+	#region SESSION MANAGERS ——————————————————————————————————————————————————————————————————————
+
+	def __enter__(self):
+		"""Use the connection within a with block. Requests always re-use the pooled connections of the session shared with the other connection handlers."""
 		return self
 
 	def __exit__(self, exc_type, exc_val, exc_tb):
-		"""Terminate the request session."""
-		self._session.close()
-		self._session = None
-
-		#END
+		"""Leave the with block. The shared session stays open, use the outer ArcgisRest instance as a context manager (or call its close method) to close it."""
+		return
 
 	#endregion
 
 
 	#region HELPERS ———————————————————————————————————————————————————————————————————————————————
 
-	def _deriveUrl(self, path: str, web_adaptor: str = None, admin: bool = False) -> str:
-		"""Derive the full URL from existing properties and those provided to the request method.
+	def _prepareUrl(self, method: str, path: str, admin: bool = False) -> str:
+		"""Check that the request can be sent and derive its full URL.
+
+		Args:
+			method (str): method of the request: GET, OPTIONS, HEAD, POST, PUT, PATCH, or DELETE.
+			path (str): Path to which to send the request, after the endpoints rest directory.
+			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
+
+		Raises:
+			ValueError: If incorrect method passed.
+			NotImplementedError: Sending a GeoEvent request via Web Adaptor isn't supported.
+
+		Returns:
+			str: The complete URL to the resource.
+		"""
+
+		# Check method is valid
+		if method not in _VALID_METHODS:
+			raise ValueError('The request method must be GET, OPTIONS, HEAD, POST, PUT, PATCH, or DELETE.')
+
+		# GeoEvent using web apators not support
+		if self.endpoint_type == 'geoevent' and self.arcgisrest.web_adaptors['arcgis'] is not None:
+			raise NotImplementedError('Sending a GeoEvent request via a proxied (or web adaptor) endpoint is not supported. Please use a direct connection.')
+
+		# Derive the full URL
+		return self._deriveUrl(path, admin)
+
+
+	def _prepareBodies(self, method: str, params: dict = None, data: dict = None, json: dict = None, token_data: dict = None) -> tuple:
+		"""Mixin the token and format into the bodies of the request and create its headers.
+
+		Args:
+			method (str): method of the request: GET, OPTIONS, HEAD, POST, PUT, PATCH, or DELETE.
+			params (dict, optional): Dictionary to send in the query string of the request. Defaults to None.
+			data (dict, optional): Dictionary to send in the body of the request. Defaults to None.
+			json (dict, optional): json data to send in the body of the request. Defaults to None.
+			token_data (dict, optional): The token data used to login to the server. Defaults to None.
+
+		Returns:
+			tuple: The updated (params, data, json, headers).
+		"""
+
+		# Generate the requires params and headers
+		if method == 'GET' and params is None:
+			params = {}
+		elif method in _BODY_METHODS and data is None and json is None:
+			data = {}
+
+		params, data, json = self._mixinBodies([params, data, json], token_data['token'] if token_data else None)
+		headers = self._getHeaders(token_data)
+
+		return params, data, json, headers
+
+
+	def _getTokenData(self) -> dict:
+		"""Get the token for this endpoint using the outer ArcgisRest's credentials, re-using a stored token if possible.
+
+		Returns:
+			dict: The token data dictionary {token, expires, ssl}.
+		"""
+		return getToken(self.endpoint_type, self._parsed_url.base, self.arcgisrest.username, self.arcgisrest.password, self.arcgisrest.public_host, self.arcgisrest.verify_ssl, self.arcgisrest.timeout, self.arcgisrest.swapToken, self.arcgisrest.session, self.arcgisrest.token_store)
+
+
+	def _discardRejectedToken(self, error: ArcGISError, token_data: dict = None):
+		"""Discard the token used by a request if the server rejected it (invalid or expired), so the next request acquires a new one.
+
+		Args:
+			error (ArcGISError): The error reported by the server.
+			token_data (dict, optional): The token data used by the request. Defaults to None.
+		"""
+		if token_data is not None and error.code in _INVALID_TOKEN_CODES:
+			invalidateToken(token_data['token'], self.arcgisrest.token_store)
+
+		return
+
+
+	@staticmethod
+	def _stringifyValues(body: dict = None) -> list:
+		"""Convert the values of a query string or form body to strings, as aiohttp only accepts strings and numbers (booleans are sent as true/false). List and tuple values are expanded into repeated keys, as requests does.
+
+		Args:
+			body (dict, optional): The parameters or form data of the request. Defaults to None.
+
+		Returns:
+			list: The (key, value) pairs of the body with their values converted to strings, or None if no body was passed.
+		"""
+		if body is None:
+			return None
+
+		pairs = []
+		for key, value in body.items():
+			for item in (value if isinstance(value, (list, tuple)) else (value,)):
+				if item is not None:
+					pairs.append((key, ('true' if item else 'false') if isinstance(item, bool) else str(item)))
+
+		return pairs
+
+
+	def _deriveUrl(self, path: str, admin: bool = False) -> str:
+		"""Derive the full URL from the connection's URL prefixes and the path provided to the request method.
 
 		Args:
 			path (str): Path to which to send the request, after the endpoints rest directory
 			            (e.g. what comes after https://example.com/arcgis/rest).
-			web_adaptor (str, optional): The web adaptor directory name. Defaults to using a direct
-			                             connection, using the default port and endpoint.
 			admin (bool, optional): Whether to connect to the admin endpoint. Defaults to False.
 
 		Returns:
 			str: The complete URL to the resource.
 		"""
 
-		ep = ENDPOINT_PROPERTIES[self.endpoint_type]
+		# Most applications request the same few paths repeatedly
+		key = (path, admin)
+		url = self._url_cache.get(key)
+		if url is not None:
+			return url
+
+		prefix = self._url_prefix_admin if admin else self._url_prefix_rest
+
+		if not path.startswith(('/', '\\')):
+			path = '/' + path
+
+		url = prefix + path
+
+		# Stop caching once full rather than growing with one-off paths (e.g. item IDs)
+		if len(self._url_cache) < _URL_CACHE_SIZE:
+			self._url_cache[key] = url
+
+		return url
+
+
+	def _derivePrefix(self, web_adaptor: str = None, admin: bool = False) -> str:
+		"""Derive the URL up to the rest (or admin) directory from the properties of the outer ArcgisRest instance.
+
+		Args:
+			web_adaptor (str, optional): The web adaptor directory name. Defaults to using a direct
+			                             connection, using the default port and endpoint.
+			admin (bool, optional): Whether to derive the admin endpoint's prefix. Defaults to False.
+
+		Returns:
+			str: The URL prefix (e.g. https://example.com/arcgis/rest).
+		"""
+
+		ep = self._ep
 
 		# Scheme (http/https)
 		scheme = "https" if self.arcgisrest.use_https else "http"
@@ -328,7 +758,7 @@ class Connection():
 
 		if ':' not in server and web_adaptor is None:
 			port = ep['port_https'] if self.arcgisrest.use_https else ep['port_http']
-			server += ':{}'.format(port)
+			server += f':{port}'
 
 		# Root Directory
 		directory = web_adaptor if web_adaptor is not None else ep['directory']
@@ -338,12 +768,8 @@ class Connection():
 		# Rest Directory
 		rest = ep['admin'] if admin else ep['rest']
 
-		# Path
-		if not path.startswith(('/', '\\')):
-			path = '/' + path
-
 		# Assemble
-		assembled = '{}://{}{}{}{}'.format(scheme, server, directory, rest, path)
+		assembled = f'{scheme}://{server}{directory}{rest}'
 
 		return assembled
 
@@ -359,23 +785,29 @@ class Connection():
 			list: The updated bodies in the same order as was passed in.
 		"""
 
-		# ArcGIS ∴ add f=json and token=xyz
-		if self.endpoint_type in ['portal', 'arcgis']:
-			mixin = {'f': 'json'}
+		# GeoEvent ∴ nothing to add
+		if self._mixin_no_token is None:
+			return bodies
 
-			if token is not None:
-				mixin['token'] = token
+		# ArcGIS ∴ add f=json and token=xyz, only rebuilding the mixin when the token changes
+		if token is None:
+			mixin = self._mixin_no_token
+		else:
+			mixin_token, mixin = self._mixin_with_token
+			if mixin_token != token:
+				mixin = {**self._mixin_no_token, 'token': token}
+				self._mixin_with_token = (token, mixin)
 
-			for idx, data in enumerate(bodies):
-				if data is not None:
-					bodies[idx] = {**data, **mixin}
-					break
+		for idx, data in enumerate(bodies):
+			if data is not None:
+				bodies[idx] = {**data, **mixin}
+				break
 
 		return bodies
 
 
 	def _getHeaders(self, token_data: dict = None) -> dict:
-		"""Create the base headers for the request, passing the accepted format (JSON) and token where required.
+		"""Create the per-request headers, passing the token where required (the accepted format is set on the shared session).
 
 		token_data (dict): The token data used to login to the server. Defaults to None.
 
@@ -383,16 +815,13 @@ class Connection():
 			dict: A set of header names and values.
 		"""
 
-		# Required to get JSON from GeoEvent endpoints (ignored by others)
-		headers = {
-			'Accept': 'application/json'
-		}
+		headers = {}
 
 		# Tokens
 		if token_data is not None:
 			# GeoEvent
 			if self.endpoint_type == 'geoevent':
-				headers['Cookie'] = 'adminToken={}'.format(token_data['token'])
+				headers['Cookie'] = f"adminToken={token_data['token']}"
 
 			if token_data.get("referer") is not None:
 				headers['Referer'] = token_data['referer']
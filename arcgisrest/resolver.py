@@ -0,0 +1,172 @@
+# coding: utf-8
+"""In-process DNS caching for the connections made by the shared session.
+   Author: David Blanchard - Esri Canada
+   Date: October 2020
+   Python: 3.8
+
+   https://github.com/dblanchardDev/arcgisrest
+
+   Copyright 2020 Esri Canada - All Rights Reserved
+   Released under the MIT license. See LICENSE file for details"""
+
+import socket
+import threading
+import time
+from contextvars import ContextVar
+
+import urllib3.util.connection
+from requests.adapters import HTTPAdapter
+
+#region RESOLVER ——————————————————————————————————————————————————————————————————————————————————
+
+class CachedResolver():
+	"""Memoize host name resolutions for a limited amount of time."""
+
+	_ttl: float = None
+	_cache: dict = None
+	_lock: threading.Lock = None
+
+
+	def __init__(self, ttl: float = 300):
+		"""Memoize host name resolutions for a limited amount of time.
+
+		Args:
+			ttl (float, optional): How many seconds a resolution is re-used before being looked up again. Defaults to 300 seconds.
+		"""
+		self._ttl = ttl
+		self._cache = {}
+		self._lock = threading.Lock()
+
+		#END
+
+
+	@property
+	def ttl(self) -> float:
+		"""float: How many seconds a resolution is re-used before being looked up again."""
+		return self._ttl
+
+
+	def getaddrinfo(self, host: str, port: int, family: int = socket.AF_UNSPEC) -> list:
+		"""Resolve a host in the same manner as socket.getaddrinfo, re-using a previous resolution if it has not expired.
+
+		Args:
+			host (str): The host name to resolve.
+			port (int): The port to which the connection will be made.
+			family (int, optional): The address family to which the resolution is restricted. Defaults to socket.AF_UNSPEC.
+
+		Returns:
+			list: The address information as returned by socket.getaddrinfo.
+		"""
+		key = (host, port, family)
+
+		entry = self._cache.get(key)
+		if entry is not None and entry[1] > time.monotonic():
+			return entry[0]
+
+		addresses = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+
+		with self._lock:
+			self._cache[key] = (addresses, time.monotonic() + self._ttl)
+
+		return addresses
+
+
+	def forget(self, host: str, port: int, family: int = socket.AF_UNSPEC):
+		"""Discard a stored resolution so that the next connection looks it up again.
+
+		Args:
+			host (str): The host name that was resolved.
+			port (int): The port to which the connection was made.
+			family (int, optional): The address family to which the resolution was restricted. Defaults to socket.AF_UNSPEC.
+		"""
+		with self._lock:
+			self._cache.pop((host, port, family), None)
+
+		return
+
+#endregion
+
+
+#region ADAPTER ———————————————————————————————————————————————————————————————————————————————————
+
+# Resolver used by the adapter currently sending a request (urllib3 opens connections synchronously from within send)
+_active_resolver: ContextVar = ContextVar('arcgisrest_active_resolver', default=None)
+_original_create_connection = urllib3.util.connection.create_connection
+_patch_lock = threading.Lock()
+
+
+def _createConnection(address: tuple, *args, **kwargs) -> socket.socket:
+	"""Replacement for urllib3's create_connection which resolves the host through the active CachedResolver (if any).
+
+	Args:
+		address (tuple): The (host, port) tuple to connect to.
+
+	Returns:
+		socket.socket: The connected socket.
+	"""
+	resolver = _active_resolver.get()
+	if resolver is None:
+		return _original_create_connection(address, *args, **kwargs)
+
+	host, port = address
+	family = urllib3.util.connection.allowed_gai_family()
+	error = None
+
+	# Connect to the resolved addresses directly, urllib3 still uses the host name for SNI and certificate checks
+	for res in resolver.getaddrinfo(host.strip('[]'), port, family):
+		try:
+			return _original_create_connection((res[4][0], port), *args, **kwargs)
+		except OSError as e:
+			error = e
+
+	# None of the stored addresses are reachable, look them up again on the next attempt
+	resolver.forget(host.strip('[]'), port, family)
+
+	if error is None:
+		error = OSError('getaddrinfo returns an empty list')
+	raise error
+
+
+def _installCreateConnection():
+	"""Route urllib3's connection creation through _createConnection, only patching once per process."""
+	with _patch_lock:
+		if urllib3.util.connection.create_connection is not _createConnection:
+			urllib3.util.connection.create_connection = _createConnection
+
+	return
+
+
+class CachedResolverAdapter(HTTPAdapter):
+	"""HTTP adapter which resolves host names through a CachedResolver."""
+
+	_resolver: CachedResolver = None
+
+
+	def __init__(self, resolver: CachedResolver, **kwargs):
+		"""HTTP adapter which resolves host names through a CachedResolver.
+
+		Args:
+			resolver (CachedResolver): The resolver to use for new connections.
+			**kwargs: Any other keyword argument accepted by requests.adapters.HTTPAdapter.
+		"""
+		self._resolver = resolver
+		_installCreateConnection()
+
+		super().__init__(**kwargs)
+
+
+	@property
+	def resolver(self) -> CachedResolver:
+		"""CachedResolver: The resolver used for new connections."""
+		return self._resolver
+
+
+	def send(self, request, **kwargs):
+		"""Send the prepared request, resolving any new connection through the adapter's resolver."""
+		token = _active_resolver.set(self._resolver)
+		try:
+			return super().send(request, **kwargs)
+		finally:
+			_active_resolver.reset(token)
+
+#endregion
@@ -9,59 +9,108 @@
    Copyright 2020 Esri Canada - All Rights Reserved
    Released under the MIT license. See LICENSE file for details"""
 
-from datetime import datetime
+import copy
+import threading
+import time
 from typing import Union
-from urllib.parse import urlsplit
 
 import requests
 
-from .utils import deriveBaseUrl, deriveRefererUrl, readEsriJson
+from .utils import ParsedUrl, parseUrl, readEsriJson, sendRequest
 
 #region HANDLE STORED TOKENS ——————————————————————————————————————————————————————————————————————
 
 _stored_tokens = {}
+_token_locks = {}
+_locks_guard = threading.Lock()
 
 
-def _getStoredToken(url: str) -> dict:
+def _getStoredToken(key: str, store: dict) -> dict:
 	"""Get an non-expired token that has been stored for re-use (if available).
 
 	Args:
-		url (str): The URL for which the token is required.
+		key (str): The cache key (base URL) for which the token is required.
+		store (dict): The token store in which to look.
 
 	Returns:
 		dict: The token data dictionary {token, expires, ssl}, or None if not found/expired.
 	"""
 
-	base_url = deriveBaseUrl(url)
-	if base_url in _stored_tokens:
-		token = _stored_tokens[base_url]
-
-		ten_minutes_ago = datetime.now().timestamp() * 1000 - 600000
-		if token['expires'] > ten_minutes_ago:
-			return token
+	entry = store.get(key)
+	if entry is not None and entry[1] > time.monotonic():
+		return entry[0]
 
 	return None
 
 
-def _setStoredToken(url: str, token_data: dict):
+def _setStoredToken(key: str, token_data: dict, store: dict):
 	"""Store or update a token for re-use.
 
 	Args:
-		url (str): The URL for which the token was generated.
+		key (str): The cache key (base URL) for which the token was generated.
 		token_data (dict): The token data dictionary {token, expires, ssl}.
+		store (dict): The token store in which to keep it.
+	"""
+
+	# Convert the epoch expiration (in ms) to a monotonic deadline, ten minutes ahead of the actual expiration
+	remaining = token_data['expires'] / 1000 - time.time()
+	store[key] = (token_data, time.monotonic() + remaining - 600)
+
+	return
+
+
+def invalidateToken(token: str, token_store: dict = None):
+	"""Discard a token that the server rejected (e.g. invalid or expired), so that the next request acquires a new one.
+
+	Args:
+		token (str): The token to discard, wherever it is stored.
+		token_store (dict, optional): The token store from which to discard it. Defaults to the module's store.
 	"""
 
-	base_url = deriveBaseUrl(url)
-	_stored_tokens[base_url] = token_data
+	store = _stored_tokens if token_store is None else token_store
+
+	for key, entry in list(store.items()):
+		if entry[0].get('token') == token:
+			store.pop(key, None)
 
 	return
 
+
+def _getTokenLock(key: str) -> threading.RLock:
+	"""Get the lock guarding the acquisition of tokens for a cache key, creating it if required.
+
+	Args:
+		key (str): The cache key (base URL) for which a token is being acquired.
+
+	Returns:
+		threading.RLock: The lock for that key.
+	"""
+
+	with _locks_guard:
+		lock = _token_locks.get(key)
+		if lock is None:
+			lock = _token_locks[key] = threading.RLock()
+
+	return lock
+
 #endregion
 
 
 #region TOKEN ACQUISITION —————————————————————————————————————————————————————————————————————————
 
-def getServerInfo(endpoint_type: str, url: str, public_host: str = None, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05) -> dict:
+# Server info keyed by (base URL, public host) as (info, etag, monotonic deadline), re-validated with its ETag until the deadline
+_info_cache = {}
+_INFO_CACHE_TTL = 3600
+
+# Port of the ArcGIS Server instance associated to a GeoEvent Server, by scheme
+_GEOEVENT_ARCGIS_PORTS = {'http': 6080, 'https': 6443}
+
+# Static parts of the token request bodies
+_TOKEN_STATIC = {'f': 'json', 'expiration': 60, 'client': 'requestip'}
+_TOKEN_STATIC_REFERER = {'f': 'json', 'expiration': 60, 'client': 'referer'}
+_SWAP_STATIC = {'f': 'json', 'expiration': 60}
+
+def getServerInfo(endpoint_type: str, url: str, public_host: str = None, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05, session: requests.Session = None) -> dict:
 	"""Retrieve ArcGIS Enterprise's rest information.
 
 	Args:
@@ -70,15 +119,16 @@ def getServerInfo(endpoint_type: str, url: str, public_host: str = None, verify_
 		public_host (str, optional): The public host or domain of the server if it differs from the url. Defaults to None.
 		verify_ssl (bool, optional): Whether to verify the SSL Certificate. Defaults to True.
 		timeout (float or tuple, optional): How many seconds to wait for the server to send data before giving up, as a float, or a (connect timeout, read timeout) tuple. To wait forever, pass a None value. Defaults to 3.05 seconds.
+		session (requests.Session or httpx.Client, optional): The session through which to send the request, re-using its pooled connections. Defaults to None (a new connection).
 
 	Returns:
-		dict: The /rest/info data from the server as a JSON dictionnary.
+		dict: The /rest/info data from the server as a JSON dictionnary (a copy of the cached data, which can be freely modified).
 	"""
 	if endpoint_type not in ['portal', 'arcgis']:
 		raise ValueError('Endpoint type must be one of ["portal", "arcgis"].')
 
 	# Derive the info URL
-	server_base = deriveBaseUrl(url)
+	server_base = parseUrl(url).base
 	info_url = server_base
 
 	if endpoint_type == 'portal':
@@ -91,14 +141,29 @@ def getServerInfo(endpoint_type: str, url: str, public_host: str = None, verify_
 	if public_host:
 		headers['Host'] = public_host
 
+	# Re-validate previously retrieved info rather than downloading it again
+	cache_key = (server_base, public_host)
+	cached = _info_cache.get(cache_key)
+	if cached is not None and (cached[1] is None or cached[2] <= time.monotonic()):
+		cached = None
+
+	if cached is not None:
+		headers['If-None-Match'] = cached[1]
+
 	# Retrieve the info
-	info_resp = requests.get(info_url, params={'f': 'json'}, timeout=timeout, verify=verify_ssl, headers=headers)
-	info = readEsriJson(info_resp, 'getting ArcGIS Server info')
+	info_resp = sendRequest(session, 'GET', info_url, verify_ssl, timeout, params={'f': 'json'}, headers=headers)
 
-	return info
+	if cached is not None and info_resp.status_code == 304:
+		info = cached[0]
+	else:
+		info = readEsriJson(info_resp, 'getting ArcGIS Server info')
+		_info_cache[cache_key] = (info, info_resp.headers.get('ETag'), time.monotonic() + _INFO_CACHE_TTL)
+
+	# Return a copy, so that changes made by the caller don't affect the cached info used for later tokens
+	return copy.deepcopy(info)
 
 
-def _generateToken(token_url: str, username: str, password: str, referer: str = None, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05) -> dict:
+def _generateToken(token_url: str, username: str, password: str, referer: str = None, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05, session: requests.Session = None) -> dict:
 	"""Send a request for a token to an ArcGIS Enterprise get token endpoint.
 
 	Args:
@@ -109,6 +174,7 @@ def _generateToken(token_url: str, username: str, password: str, referer: str =
 		                         If not specified, will generate a request IP token.
 		verify_ssl (bool, optional): Whether to verify the SSL certificates. Defaults to True.
 		timeout (float or tuple, optional): How many seconds to wait for the server to send data before giving up, as a float, or a (connect timeout, read timeout) tuple. To wait forever, pass a None value. Defaults to 3.05 seconds.
+		session (requests.Session or httpx.Client, optional): The session through which to send the request, re-using its pooled connections. Defaults to None (a new connection).
 
 	Returns:
 		dict: The JSON dictionnary token return from the server.
@@ -118,14 +184,12 @@ def _generateToken(token_url: str, username: str, password: str, referer: str =
 	if verify_ssl and not token_url.startswith('https://'):
 		raise requests.exceptions.SSLError('Not authorized to send credentials over an unencrypted connection. Either use an encrypted connection or set verify_ssl to False.')
 
-	response = requests.post(token_url, data={
-		'f': 'json',
-		'expiration': 60,
-		'username': username,
-		'password': password,
-		'client': 'requestip' if referer is None else 'referer',
-		'referer': referer or '',
-	}, timeout=timeout, verify=verify_ssl)
+	if referer is None:
+		data = {**_TOKEN_STATIC, 'username': username, 'password': password}
+	else:
+		data = {**_TOKEN_STATIC_REFERER, 'username': username, 'password': password, 'referer': referer}
+
+	response = sendRequest(session, 'POST', token_url, verify_ssl, timeout, data=data)
 
 	token_data = readEsriJson(response, 'getting a token')
 	token_data["referer"] = referer
@@ -133,7 +197,7 @@ def _generateToken(token_url: str, username: str, password: str, referer: str =
 	return token_data
 
 
-def _swapPortalForServerToken(token_url: str, url: str, token: str, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05) -> dict:
+def _swapPortalForServerToken(token_url: str, url: str, token: str, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05, session: requests.Session = None) -> dict:
 	"""Send a request for a referer token to an ArcGIS Enterprise get token endpoint.
 
 	Args:
@@ -142,24 +206,59 @@ def _swapPortalForServerToken(token_url: str, url: str, token: str, verify_ssl:
 		token (str): Portal token that is being upgraded.
 		verify_ssl (bool, optional): Whether to verify the SSL certificates. Defaults to True.
 		timeout (float or tuple, optional): How many seconds to wait for the server to send data before giving up, as a float, or a (connect timeout, read timeout) tuple. To wait forever, pass a None value. Defaults to 3.05 seconds.
+		session (requests.Session or httpx.Client, optional): The session through which to send the request, re-using its pooled connections. Defaults to None (a new connection).
 
 	Returns:
 		dict: The JSON dictionnary token return from the server.
 	"""
 
-	response = requests.post(token_url, data={
-		'f': 'json',
-		'expiration': 60,
-		'serverURL': url,
-		'token': token,
-	}, timeout=timeout, verify=verify_ssl)
+	response = sendRequest(session, 'POST', token_url, verify_ssl, timeout, data={**_SWAP_STATIC, 'serverURL': url, 'token': token})
 
 	token_data = readEsriJson(response, 'swapping portal token for server token')
 
 	return token_data
 
 
-def getToken(endpoint_type: str, url: str, username: str, password: str, public_host: str = None, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05, swapToken: bool = False) -> dict:
+def _acquireToken(endpoint_type: str, url: str, username: str, password: str, public_host: str, verify_ssl: bool, timeout: Union[float, tuple], swapToken: bool, session: requests.Session, parsed: ParsedUrl, store: dict) -> dict:
+	"""Acquire a new token for a portal or ArcGIS Server URL and store it for re-use. Arguments are the same as getToken, with the url's ParsedUrl and the token store.
+
+	Returns:
+		dict: The token data dictionary {token, expires, ssl}.
+	"""
+
+	# Get the server information & validate it's data
+	info = getServerInfo(endpoint_type, url, public_host, verify_ssl, timeout, session)
+
+	if not info['authInfo']['isTokenBasedSecurity']:
+		raise NotImplementedError('ArcGISREST does not support non token based securities.')
+
+	token_url = info['authInfo']['tokenServicesUrl']
+
+	if token_url == '':
+		raise Exception(f'The server rest info retrieved for {url} does not contain a token service URL. Unable to authenticate. Try specifying a public host.')
+
+	# Get the token (the token service may be shared with other endpoints)
+	token_key = parseUrl(token_url).base
+	token_data = _getStoredToken(token_key, store)
+
+	if token_data is None:
+		with _getTokenLock(token_key):
+			token_data = _getStoredToken(token_key, store)
+			if token_data is None:
+				token_data = _generateToken(token_url, username, password, parsed.referer, verify_ssl, timeout, session)
+				_setStoredToken(token_key, token_data, store)
+
+	# If federated server, swap Portal token for server token if requested
+	if swapToken and endpoint_type == 'arcgis' and 'owningSystemUrl' in info:
+		token_data = _swapPortalForServerToken(token_url, url, token_data['token'], verify_ssl, timeout, session)
+		_setStoredToken(parsed.base, token_data, store)
+	else:
+		_setStoredToken(parsed.base, token_data, store)
+
+	return token_data
+
+
+def getToken(endpoint_type: str, url: str, username: str, password: str, public_host: str = None, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05, swapToken: bool = False, session: requests.Session = None, token_store: dict = None) -> dict:
 	"""Get an ArcGIS token for a URL. Will re-use previous tokens if they have 10 or more minutes until expiration.
 
 	Args:
@@ -172,6 +271,8 @@ def getToken(endpoint_type: str, url: str, username: str, password: str, public_
 		timeout (float or tuple, optional): How many seconds to wait for the server to send data before giving up, as a float, or a (connect timeout, read timeout) tuple. To wait forever, pass a None value. Defaults to 3.05 seconds.
 		swapToken (bool, optional): Whether portal tokens will be swapped for ArcGIS Server tokens before use
 				on federated servers. Defaults to false as normally the portal token can be used.
+		session (requests.Session or httpx.Client, optional): The session through which to send the request, re-using its pooled connections. Defaults to None (a new connection).
+		token_store (dict, optional): The store in which tokens are kept for re-use, allowing them to be isolated per set of credentials. Defaults to the module's store.
 
 	Raises:
 		NotImplementedError: Authentications other than token based are not implemented.
@@ -180,48 +281,32 @@ def getToken(endpoint_type: str, url: str, username: str, password: str, public_
 		dict: The token data dictionary {token, expires, ssl}.
 	"""
 
+	parsed = parseUrl(url)
+	cache_key = parsed.base
+	store = _stored_tokens if token_store is None else token_store
+
 	# Portal & ArcGIS follow a standard flow for tokens
 	if endpoint_type in ['portal', 'arcgis']:
 
-		token_data = _getStoredToken(url)
+		token_data = _getStoredToken(cache_key, store)
 		if token_data is None:
 
-			# Get the server information & validate it's data
-			info = getServerInfo(endpoint_type, url, public_host, verify_ssl, timeout)
-
-			if not info['authInfo']['isTokenBasedSecurity']:
-				raise NotImplementedError('ArcGISREST does not support non token based securities.')
-
-			token_url = info['authInfo']['tokenServicesUrl']
-
-			if token_url == '':
-				raise Exception('The server rest info retrieved for {} does not contain a token service URL. Unable to authenticate. Try specifying a public host.'.format(url))
-
-			# Get the token
-			token_data = _getStoredToken(token_url)
-
-			if token_data is None:
-				token_data = _generateToken(token_url, username, password, deriveRefererUrl(url), verify_ssl, timeout)
-				_setStoredToken(token_url, token_data)
-
-			# If federated server, swap Portal token for server token if requested
-			if swapToken and endpoint_type == 'arcgis' and 'owningSystemUrl' in info:
-				token_data = _swapPortalForServerToken(token_url, url, token_data['token'], verify_ssl, timeout)
-				_setStoredToken(url, token_data)
-			else:
-				_setStoredToken(url, token_data)
+			# Only one thread acquires the token, the others wait for it and then re-use it
+			with _getTokenLock(cache_key):
+				token_data = _getStoredToken(cache_key, store)
+				if token_data is None:
+					token_data = _acquireToken(endpoint_type, url, username, password, public_host, verify_ssl, timeout, swapToken, session, parsed, store)
 
 	# GeoEvent requires that we go up to it's associated ArcGIS Server instance
 	elif endpoint_type == 'geoevent':
 
 		# Derive ArcGIS Server's URL
-		us = urlsplit(url)
-		port = 6080 if us.scheme == 'http' else '6443'
-		arcgis_url = '{}://{}:{}/arcgis'.format(us.scheme, us.hostname, port)
+		port = _GEOEVENT_ARCGIS_PORTS.get(parsed.scheme, 6443)
+		arcgis_url = f'{parsed.scheme}://{parsed.hostname}:{port}/arcgis'
 
 		# Get token for ArcGIS Server
-		token_data = getToken('arcgis', arcgis_url, username, password, public_host, verify_ssl, timeout, swapToken)
-		_setStoredToken(url, token_data)
+		token_data = getToken('arcgis', arcgis_url, username, password, public_host, verify_ssl, timeout, swapToken, session, store)
+		_setStoredToken(cache_key, token_data, store)
 
 	# Un-recognized endpoint
 	else:
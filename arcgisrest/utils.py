@@ -9,12 +9,36 @@
    Copyright 2020 Esri Canada - All Rights Reserved
    Released under the MIT license. See LICENSE file for details"""
 
-import json
 import logging
-from urllib.parse import urlsplit, urlunsplit
+from collections import namedtuple
+from functools import lru_cache
+from typing import Iterator, Union
+from urllib.parse import urlsplit
 
 import requests
 
+# Use the faster orjson parser when it is installed
+try:
+	import orjson as _json
+except ImportError:
+	import json as _json
+
+_loads = _json.loads
+
+# Streaming large responses is only available when ijson is installed
+try:
+	import ijson
+except ImportError:
+	ijson = None
+
+# The HTTP/2 transport is only available when httpx is installed
+try:
+	import httpx
+	_HTTP_STATUS_ERRORS = (requests.HTTPError, httpx.HTTPStatusError)
+except ImportError:
+	httpx = None
+	_HTTP_STATUS_ERRORS = (requests.HTTPError,)
+
 
 def logDebug():
 	"""Activate output of debug messages to logging."""
@@ -38,48 +62,117 @@ def deriveBaseUrl(url: str) -> str:
 	Returns:
 		str: The base URL to the server endpoint.
 	"""
+	return parseUrl(url).base
+
+
+@lru_cache(maxsize=128)
+def deriveRefererUrl(url: str) -> str:
+	"""Derive the referer URL for tokens (e.g. https://domain.com).
+
+	Args:
+		url (str): The full URL from which to derive the referer URL.
+
+	Raises:
+		ValueError: URL is missing the scheme, or domain.
+
+	Returns:
+		str: The referer URL to use for tokens.
+	"""
 
 	us = urlsplit(url)
 
-	if us.scheme is None or us.netloc is None or us.path is None:
-		raise ValueError('The URL "{}" is missing either its scheme, domain, or path.'.format(url))
+	if not us.scheme or not us.netloc:
+		raise ValueError(f'The URL "{url}" is missing either its scheme, or domain.')
 
-	path_split = us.path.split('/')
-	if len(path_split) < 2:
-		raise ValueError('The URL "{}" must contain the endpoint root directory.'.format(url))
+	return f'{us.scheme}://{us.netloc}'
 
-	base = urlunsplit((us.scheme, us.netloc, path_split[1], None, None))
 
-	return base
+def deriveBaseAndReferer(url: str) -> tuple:
+	"""Derive both the base URL to an ArcGIS Server endpoint and the referer URL for its tokens, splitting the URL only once.
 
+	Args:
+		url (str): The full URL from which to derive the URLs.
 
-def deriveRefererUrl(url: str) -> str:
-	"""Derive the referer URL for tokens (e.g. https://domain.com).
+	Raises:
+		ValueError: URL is missing the scheme, domain, or path to the root directory of the server endpoint.
+
+	Returns:
+		tuple: The (base URL, referer URL), e.g. (https://domain.com/arcgis, https://domain.com).
+	"""
+	parsed = parseUrl(url)
+
+	return parsed.base, parsed.referer
+
+
+ParsedUrl = namedtuple('ParsedUrl', ['scheme', 'netloc', 'hostname', 'root_path', 'base', 'referer'])
+ParsedUrl.__doc__ = """The components of an ArcGIS Server endpoint URL required for authentication."""
+
+
+@lru_cache(maxsize=64)
+def parseUrl(url: str) -> ParsedUrl:
+	"""Split an ArcGIS Server endpoint URL once, deriving both its base and referer URLs. Results are cached as only a few distinct server URLs are normally used.
 
 	Args:
-		url (str): The full URL from which to derive the referer URL.
+		url (str): The full URL to parse.
 
 	Raises:
-		ValueError: URL is missing the scheme, or domain.
+		ValueError: URL is missing the scheme, domain, or path to the root directory of the server endpoint.
 
 	Returns:
-		str: The referer URL to use for tokens.
+		ParsedUrl: The scheme, netloc, hostname, root directory, base URL (e.g. https://domain.com/arcgis) and referer URL (e.g. https://domain.com).
 	"""
 
 	us = urlsplit(url)
 
-	if us.scheme is None or us.netloc is None:
-		raise ValueError('The URL "{}" is missing either its scheme, or domain.'.format(url))
+	if not us.scheme or not us.netloc:
+		raise ValueError(f'The URL "{url}" is missing either its scheme, domain, or path.')
+
+	root_path, _, _ = us.path.lstrip('/').partition('/')
+	if not root_path:
+		raise ValueError(f'The URL "{url}" must contain the endpoint root directory.')
 
-	referer = urlunsplit((us.scheme, us.netloc, '', None, None))
+	referer = f'{us.scheme}://{us.netloc}'
+	base = f'{referer}/{root_path}'
 
-	return referer
+	return ParsedUrl(us.scheme, us.netloc, us.hostname, root_path, base, referer)
 
 #endregion
 
 
 #region REQUESTS HELPERS ——————————————————————————————————————————————————————————————————————————
 
+# Error messages, formatted with the action, URL, and details only when first read
+_HTTP_ERROR_MESSAGE = 'ArcgisRest encountered an HTTP error while {} at URL "{}" >> {}'
+_ARCGIS_ERROR_MESSAGE = 'ArcgisRest encoutered an ArcGIS error while {} at URL "{}" >> {}: {} - {}'
+_UNSUCCESSFUL_MESSAGE = 'ArcgisRest encoutered an unsuccessful response from ArcGIS while {} at URL "{}" >> {}'
+
+
+def sendRequest(session, method: str, url: str, verify_ssl: bool = True, timeout: Union[float, tuple] = 3.05, **kwargs) -> requests.Response:
+	"""Send a request through either a requests session or an httpx client, adapting the SSL verification and timeout to each.
+
+	Args:
+		session (requests.Session or httpx.Client): The session or client through which to send the request. If None, uses a new requests connection.
+		method (str): The HTTP method of the request.
+		url (str): The URL to which to send the request.
+		verify_ssl (bool, optional): Whether to verify the SSL certificates (for an httpx client, set when it is created instead). Defaults to True.
+		timeout (float or tuple, optional): How many seconds to wait for the server to send data before giving up, as a float, or a (connect timeout, read timeout) tuple. To wait forever, pass a None value. Defaults to 3.05 seconds.
+		**kwargs: The params, data, json, files, and headers of the request, and whether to stream its body (requests only).
+
+	Returns:
+		requests.Response: The response (an httpx.Response if sent through an httpx client).
+	"""
+	if httpx is not None and isinstance(session, httpx.Client):
+		if isinstance(timeout, tuple):
+			timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+
+		# Streamed responses are read from the raw body of requests responses, so httpx bodies are always read
+		kwargs.pop('stream', None)
+
+		return session.request(method, url, timeout=timeout, **kwargs)
+
+	return (session or requests).request(method, url, timeout=timeout, verify=verify_ssl, **kwargs)
+
+
 def readEsriJson(response: requests.Response, action: str) -> dict:
 	"""Read the JSON from a request to an Esri server, raising an error for HTTP errors and ArcGIS errors.
 
@@ -91,57 +184,206 @@ def readEsriJson(response: requests.Response, action: str) -> dict:
 		requests.exceptions.HTTPError: An error was either found in the response code or the Esri content.
 
 	Returns:
-		dict: The JSON dictionary from the response.
+		dict: The JSON dictionary from the response, or None for HEAD requests and 204 (No Content) responses.
 	"""
 	data = None
 
 	# Check for standard HTTP errors
-	try:
-		response.raise_for_status()
-	except requests.HTTPError as e:
-		message = 'ArcgisRest encountered an HTTP error while {} at URL "{}" >> {}'.format(action, response.url, e)
-		raise HTTPError(response, message)
+	_checkHttpStatus(response, action)
 
-	# Read the content
+	# Nothing to parse for responses without a body, any other empty body is reported as invalid JSON below
+	if response.status_code == 204 or response.request.method == 'HEAD':
+		return data
+
+	# JSON is UTF-8, so avoid charset detection if the caller later reads response.text
+	if 'charset' not in response.headers.get('Content-Type', ''):
+		response.encoding = 'utf-8'
+
+	# Read the content (parsing the raw bytes, both parsers accept them directly)
 	try:
-		data = response.json()
+		data = _loads(response.content)
+	except ValueError: # Includes the decode errors of both parsers
+		raise requests.exceptions.RequestException(f'Unable to read the JSON for {response.url}')
+
+	# Check for Esri errors
+	if isinstance(data, dict):
+		_checkEsriErrors(response, data, action)
+
+	return data
+
+
+async def readEsriJsonAsync(response, action: str) -> dict:
+	"""Read the JSON from an asynchronous request to an Esri server, raising an error for HTTP errors and ArcGIS errors.
+
+	Args:
+		response (aiohttp.ClientResponse): The response object to parse.
+		action (str): A short description of the action being taken by the request.
 
-		# Check for Esri errors
-		if 'error' in data:
-			error = data['error']
-			code = error['code'] if 'code' in error else 'X'
-			msg = error['message'] if 'message' in error else 'No Message'
-			dtls = '; '.join(error['details']) if 'details' in error and error['details'] is not None else 'No Details'
+	Raises:
+		requests.exceptions.HTTPError: An error was either found in the response code or the Esri content.
 
-			message = 'ArcgisRest encoutered an ArcGIS error while {} at URL "{}" >> {}: {} - {}'.format(action, response.url, code, msg, dtls)
-			raise ArcGISError(response, message)
+	Returns:
+		dict: The JSON dictionary from the response, or None for HEAD requests and 204 (No Content) responses.
+	"""
+	# Check for standard HTTP errors
+	if response.status >= 400:
+		raise HTTPError(response, _HTTP_ERROR_MESSAGE, action, response.url, f'{response.status} {response.reason}')
 
-		if 'success' in data and not data['success']:
-			message = 'ArcgisRest encoutered an unsuccessful response from ArcGIS while {} at URL "{}" >> {}'.format(action, response.url, response.json())
-			raise ArcGISError(response, message)
+	# Nothing to parse for responses without a body, any other empty body is reported as invalid JSON below
+	if response.status == 204 or response.method == 'HEAD':
+		return None
 
-	except json.decoder.JSONDecodeError:
-		raise requests.exceptions.RequestException('Unable to read the JSON for {}'.format(response.url))
+	content = await response.read()
 
-	except ValueError:
-		pass # Response didn't contain JSON
+	# Read the content (parsing the raw bytes, regardless of whether ArcGIS labelled them as JSON)
+	try:
+		data = _loads(content)
+	except ValueError: # Includes the decode errors of both parsers
+		raise requests.exceptions.RequestException(f'Unable to read the JSON for {response.url}')
+
+	# Check for Esri errors
+	if isinstance(data, dict):
+		_checkEsriErrors(response, data, action)
 
 	return data
 
 
+def readEsriJsonStreaming(response: requests.Response, action: str, prefix: str = 'features.item') -> Iterator:
+	"""Lazily read the items of a large JSON response from an Esri server (e.g. the features of a query), raising an error for HTTP errors and ArcGIS errors.
+	Requires the ijson package and a response requested with stream=True through the requests transport.
+
+	Args:
+		response (requests.Response): The streamed response object to parse.
+		action (str): A short description of the action being taken by the request.
+		prefix (str, optional): The ijson prefix of the items to yield. Defaults to 'features.item'.
+
+	Raises:
+		ImportError: The ijson package is not installed.
+		requests.exceptions.HTTPError: An error was either found in the response code or the Esri content.
+
+	Yields:
+		dict: Each item found under the prefix, as it is received.
+	"""
+	if ijson is None:
+		raise ImportError('Streaming Esri JSON requires the ijson package.')
+
+	# Check for standard HTTP errors
+	_checkHttpStatus(response, action)
+
+	# Build each item (and any top-level error) from the parsing events, without holding the whole document
+	response.raw.decode_content = True
+	builder = None
+	current = None
+
+	for path, event, value in ijson.parse(response.raw, use_float=True):
+		if builder is not None:
+			builder.event(event, value)
+
+			if path == current and event in ('end_map', 'end_array'):
+				if current == prefix:
+					yield builder.value
+				else:
+					_checkEsriErrors(response, {current: builder.value}, action)
+				builder = None
+
+		elif path in (prefix, 'error') and event in ('start_map', 'start_array'):
+			builder = ijson.ObjectBuilder()
+			builder.event(event, value)
+			current = path
+
+		elif path == prefix:
+			yield value
+
+		elif path == 'success' and event == 'boolean':
+			_checkEsriErrors(response, {'success': value}, action)
+
+	return
+
+
+def _checkHttpStatus(response: requests.Response, action: str):
+	"""Raise an error if the response has a non-successful HTTP status code.
+
+	Args:
+		response (requests.Response): The response object to check.
+		action (str): A short description of the action being taken by the request.
+
+	Raises:
+		HTTPError: The status code is 400 or above.
+	"""
+	if response.status_code < 400:
+		return
+
+	try:
+		response.raise_for_status()
+	except _HTTP_STATUS_ERRORS as e:
+		raise HTTPError(response, _HTTP_ERROR_MESSAGE, action, response.url, e)
+
+	return
+
+
+def _checkEsriErrors(response: requests.Response, data: dict, action: str):
+	"""Raise an error if ArcGIS reported an error or an unsuccessful operation in the response body.
+
+	Args:
+		response (requests.Response): The response from which the data was read.
+		data (dict): The JSON dictionary read from the response.
+		action (str): A short description of the action being taken by the request.
+
+	Raises:
+		ArcGISError: An error or unsuccessful operation was reported.
+	"""
+	error = data.get('error')
+	if isinstance(error, dict):
+		code = error.get('code', 'X')
+		msg = error.get('message', 'No Message')
+		details = error.get('details')
+		dtls = '; '.join(str(d) for d in details) if details else 'No Details'
+
+		raise ArcGISError(response, _ARCGIS_ERROR_MESSAGE, action, response.url, code, msg, dtls, code=error.get('code'))
+
+	if not data.get('success', True):
+		raise ArcGISError(response, _UNSUCCESSFUL_MESSAGE, action, response.url, data)
+
+	return
+
+
 class ArcgisRestException(Exception):
 	"""An ArcgisRest request returned an error."""
 
-	def __init__(self, response: requests.Response, message: str):
+	def __init__(self, response: requests.Response, message: str, *args):
 		"""An ArcgisRest request returned an error.
 
 		Args:
 			response (requests.Reponse): Response from the request.
-			message (str): Explenation of the error.
+			message (str): Explenation of the error. If args are passed, a format string into which they are inserted when the message is first read.
+			*args: Values to insert into the message.
 		"""
 		self._response = response
 		self._message = message
-		super().__init__(self.message)
+		self._args = args
+		super().__init__()
+
+
+	def __str__(self) -> str:
+		"""str: Explenation of the error."""
+		return self.message
+
+
+	def __repr__(self) -> str:
+		"""str: Representation of the error, with its formatted message."""
+		return f'{type(self).__name__}({self.message!r})'
+
+
+	@property
+	def args(self) -> tuple:
+		"""tuple: The formatted message, as the only argument of the error."""
+		return (self.message,)
+
+
+	@args.setter
+	def args(self, value: tuple):
+		"""tuple: The formatted message, as the only argument of the error."""
+		self.message = str(value[0]) if value else ''
 
 
 	@property
@@ -153,6 +395,10 @@ class ArcgisRestException(Exception):
 	@property
 	def message(self):
 		"""str: Explenation of the error."""
+		if self._args:
+			self._message = self._message.format(*self._args)
+			self._args = ()
+
 		return self._message
 
 
@@ -160,6 +406,7 @@ class ArcgisRestException(Exception):
 	def message(self, value: str):
 		"""str: Explenation of the error."""
 		self._message = value
+		self._args = ()
 
 
 class HTTPError(ArcgisRestException):
@@ -169,4 +416,22 @@ class HTTPError(ArcgisRestException):
 class ArcGISError(ArcgisRestException):
 	"""ArcGIS Enterprise reported an error within its response body."""
 
+	def __init__(self, response: requests.Response, message: str, *args, code: int = None):
+		"""ArcGIS Enterprise reported an error within its response body.
+
+		Args:
+			response (requests.Reponse): Response from the request.
+			message (str): Explenation of the error. If args are passed, a format string into which they are inserted when the message is first read.
+			*args: Values to insert into the message.
+			code (int, optional): The error code reported by ArcGIS. Defaults to None.
+		"""
+		self._code = code
+		super().__init__(response, message, *args)
+
+
+	@property
+	def code(self) -> int:
+		"""int: The error code reported by ArcGIS (e.g. 498 for an invalid token), or None if not reported."""
+		return self._code
+
 #endregion